@@ -1,2 +1,2 @@
-from leftcorner.semiring import Real, Boolean, Log, MaxTimes, MaxPlus, Entropy
+from leftcorner.semiring import Real, Boolean, Log, MaxTimes, MaxPlus, Entropy, ArrayChart
 from leftcorner.cfg import CFG, Rule, Derivation, Chart
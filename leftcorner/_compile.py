@@ -0,0 +1,95 @@
+"""
+Compiled kernels: CKY for the real semiring, agenda evaluation for the
+boolean semiring.
+
+Numba is an optional dependency.  When it is unavailable, `HAS_NUMBA` is false
+and `CFG` falls back to its NumPy/pure-Python implementations; the functions
+below still work (uncompiled), which is handy for debugging.
+
+All kernels work on float64 values; boolean weights are encoded as 0/1.
+"""
+import numpy as np
+
+try:
+    import numba
+    HAS_NUMBA = True
+    njit = numba.njit(cache=True)
+except ImportError:   # pragma: no cover
+    HAS_NUMBA = False
+    def njit(f): return f
+
+
+@njit
+def _cky_njit(Xs, Ys, Zs, ws, term_off, term_heads, term_ws, N, nN):
+    "CKY over binary rules `Xs → Ys Zs`; preterminals of position i are term_off[i]:term_off[i+1]."
+    c = np.zeros((N+1, nN, N+1))
+    for i in range(N):
+        for t in range(term_off[i], term_off[i+1]):
+            c[i, term_heads[t], i+1] += term_ws[t]
+    for span in range(2, N + 1):
+        for i in range(N - span + 1):
+            k = i + span
+            for j in range(i + 1, k):
+                for r in range(len(Xs)):
+                    c[i, Xs[r], k] += ws[r] * c[i, Ys[r], j] * c[j, Zs[r], k]
+    return c
+
+
+@njit
+def _agenda_njit(routing_off, routing_rule, routing_pos, body_off, body_flat,
+                 ws, heads, change, init, max_iters):
+    """
+    Semi-naive evaluation for the boolean semiring (values 0/1);
+    `routing_off[u]:routing_off[u+1]` indexes the (rule, position) pairs where
+    symbol `u` appears in a body.  The symbols in `init` (distinct) are the
+    initial agenda; like `dict.popitem`, the most recently added item is popped
+    first.  Returns the values and whether the agenda emptied within
+    `max_iters` pops (a compiled loop cannot be interrupted).
+    """
+    nS = len(change)
+    old = np.zeros(nS)
+    queued = np.zeros(nS, dtype=np.bool_)
+    stack = np.empty(nS, dtype=np.int64)
+    top = 0
+    for u in init:
+        queued[u] = True
+        stack[top] = u
+        top += 1
+
+    iters = 0
+    while top > 0:
+        iters += 1
+        if iters > max_iters: return old, False
+        top -= 1
+        u = stack[top]
+        queued[u] = False
+        v = change[u]
+        change[u] = 0
+
+        new = min(old[u] + v, 1.0)
+        if new == old[u]: continue
+
+        for t in range(routing_off[u], routing_off[u+1]):
+            r = routing_rule[t]
+            k = routing_pos[t]
+            W = ws[r]
+            for p in range(body_off[r], body_off[r+1]):
+                y = body_flat[p]
+                j = p - body_off[r]
+                if y == u:
+                    if j < k:    W *= new
+                    elif j == k: W *= v
+                    else:        W *= old[u]
+                else:
+                    W *= old[y]
+
+            h = heads[r]
+            change[h] = min(change[h] + W, 1.0)
+            if not queued[h]:
+                queued[h] = True
+                stack[top] = h
+                top += 1
+
+        old[u] = new
+
+    return old, True
@@ -4,12 +4,19 @@ import numpy as np
 import networkx as nx
 import graphviz
 
-from collections import defaultdict, Counter
-from functools import cached_property
-from itertools import product
+from collections import defaultdict, Counter, deque
+from heapq import heappush, heappop
 
-from leftcorner.semiring import Semiring, Boolean
+from leftcorner.semiring import Semiring, ArrayChart, Boolean, Real, Log
 from leftcorner.misc import colors, format_table
+from leftcorner import _compile
+
+
+_EMPTY = frozenset()
+
+
+# a rule `weight: head → body`, one per line
+_RULE_RE = re.compile(r'^[ \t]*(.*):[ \t]*(\S+)[ \t]*→[ \t]*(.*?)[ \t]*$', re.MULTILINE)
 
 
 def _gen_nt(prefix=''):
@@ -27,6 +34,43 @@ def keep_nonzero(semiring, chart):
     return new
 
 
+def _from_float(R, x):
+    "Convert a float computed by one of the dense (real or boolean) kernels into semiring `R`."
+    if R is Boolean: return Boolean.one if x else Boolean.zero
+    return R(float(x))
+
+
+class _cached_property:
+    "`functools.cached_property` without the per-class lock of Python < 3.12."
+
+    def __init__(self, f):
+        self.f = f
+        self.name = f.__name__
+        self.__doc__ = f.__doc__
+
+    def __get__(self, obj, cls=None):
+        if obj is None: return self
+        # non-data descriptor: later lookups find the value in `obj.__dict__`
+        v = obj.__dict__[self.name] = self.f(obj)
+        return v
+
+
+class _rule_property(_cached_property):
+    """
+    A cached property of a grammar's rules.  The values live in `obj._caches`,
+    so that `CFG.add` can invalidate all of them at once.
+    """
+
+    def __get__(self, obj, cls=None):
+        if obj is None: return self
+        caches = obj._caches
+        try:
+            return caches[self.name]
+        except KeyError:
+            v = caches[self.name] = self.f(obj)
+            return v
+
+
 # TODO: make this what Semiring.chart returns
 class Chart(dict):
 
@@ -38,6 +82,8 @@ class Chart(dict):
 
 class Slash:
 
+    __slots__ = ('Y', 'Z', 'id', '_hash')
+
     def __init__(self, Y, Z, id):
         self.Y, self.Z = Y, Z
         self._hash = hash((Y, Z, id))
@@ -53,8 +99,9 @@ class Slash:
         return self._hash
 
     def __eq__(self, other):
-        return (
+        return self is other or (
             isinstance(other, Slash)
+            and self._hash == other._hash
             and self.Y == other.Y
             and self.Z == other.Z
             and self.id == other.id
@@ -63,6 +110,8 @@ class Slash:
 
 class Frozen:
 
+    __slots__ = ('X', 'id', '_hash')
+
     def __init__(self, X, id):
         self._hash = hash((X, id))
         self.X = X
@@ -78,8 +127,9 @@ class Frozen:
         return self._hash
 
     def __eq__(self, other):
-        return (
+        return self is other or (
             isinstance(other, Frozen)
+            and self._hash == other._hash
             and self.X == other.X
             and self.id == other.id
         )
@@ -87,6 +137,8 @@ class Frozen:
 
 class Rule:
 
+    __slots__ = ('w', 'head', 'body', '_hash')
+
     def __init__(self, w, head, body):
         self.w = w
         self.head = head
@@ -110,18 +162,89 @@ class Rule:
         return f'{self.w}: {self.head} → {" ".join(map(str, self.body))}'
 
 
+def _same_rules(a, b):
+    "Multiset equality of two rule lists."
+    if len(a) != len(b): return False
+    key = lambda r: r._hash
+    a = sorted(a, key=key)
+    b = sorted(b, key=key)
+    for i, (x, y) in enumerate(zip(a, b)):
+        if x != y:
+            # rules with equal hashes may be sorted in a different order
+            return Counter(a[i:]) == Counter(b[i:])
+    return True
+
+
+def _scc(n, src, dst):
+    """
+    Strongly connected component of each node `0, ..., n-1` of the graph with
+    edges `src[e] → dst[e]` (iterative version of Tarjan's algorithm).
+    """
+    order = np.argsort(src, kind='stable')
+    adj = dst[order].tolist()
+    off = np.searchsorted(src[order], np.arange(n + 1)).tolist()
+
+    index = [-1] * n
+    low = [0] * n
+    on_stack = [False] * n
+    comp = [-1] * n
+    stack = []
+    counter = 0
+    ncomp = 0
+    for root in range(n):
+        if index[root] >= 0: continue
+        index[root] = low[root] = counter; counter += 1
+        stack.append(root); on_stack[root] = True
+        work = [(root, off[root])]   # (node, next edge to visit)
+        while work:
+            v, e = work[-1]
+            if e < off[v+1]:
+                work[-1] = (v, e+1)
+                w = adj[e]
+                if index[w] < 0:
+                    index[w] = low[w] = counter; counter += 1
+                    stack.append(w); on_stack[w] = True
+                    work.append((w, off[w]))
+                elif on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                work.pop()
+                if work:
+                    u = work[-1][0]
+                    if low[v] < low[u]: low[u] = low[v]
+                if low[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        comp[w] = ncomp
+                        if w == v: break
+                    ncomp += 1
+    return comp
+
+
 class Derivation:
 
+    __slots__ = ('r', 'x', 'ys', '_hash', '_w', '_yield')
+
     def __init__(self, r, x, *ys):
         assert isinstance(r, Rule) or r is None
         self.r = r
         self.x = x
         self.ys = ys
+        self._hash = hash((x, ys))
+        self._yield = None   # computed on demand by `Yield`
+        # the weight is known up front unless some rule is missing (e.g., `tree`)
+        W = None if r is None else r.w
+        for y in ys:
+            if W is None: break
+            if isinstance(y, Derivation):
+                W = None if y._w is None else W * y._w
+        self._w = W
 
     # Warning: Currently, Derivations compare equal even if they have different rules.
     def __hash__(self):
 #        return hash((self.r, self.x, self.ys))
-        return hash((self.x, self.ys))
+        return self._hash
 
     def __eq__(self, other):
 #        return (self.r, self.x, self.ys) == (other.r, other.x, other.ys)
@@ -135,6 +258,7 @@ class Derivation:
 
     def weight(self):
         "Compute this weight this `Derivation`."
+        if self._w is not None: return self._w
         W = self.r.w
         for y in self.ys:
             if isinstance(y, Derivation):
@@ -142,14 +266,41 @@ class Derivation:
         return W
 
     def Yield(self):
-        if isinstance(self, Derivation):
-            return tuple(w for y in self.ys for w in Derivation.Yield(y))
-        else:
-            return (self,)
+        if not isinstance(self, Derivation): return (self,)
+        if self._yield is not None: return self._yield
+        # explicit stack (no recursion limit on deep derivations)
+        out = []
+        stack = [self]
+        while stack:
+            d = stack.pop()
+            if not isinstance(d, Derivation):
+                out.append(d)
+            elif d._yield is not None:
+                out.extend(d._yield)
+            else:
+                stack.extend(reversed(d.ys))
+        self._yield = tuple(out)
+        return self._yield
 
     def to_nltk(self):
         if not isinstance(self, Derivation): return self
-        return nltk.Tree(str(self.x), [Derivation.to_nltk(y) for y in self.ys])
+        # post-order walk: a node is built once all of its children are on `done`
+        done = []
+        stack = [(self, False)]
+        while stack:
+            d, expanded = stack.pop()
+            if not isinstance(d, Derivation):
+                done.append(d)
+            elif expanded:
+                n = len(d.ys)
+                children = done[len(done)-n:]
+                del done[len(done)-n:]
+                done.append(nltk.Tree(str(d.x), children))
+            else:
+                stack.append((d, True))
+                stack.extend((y, False) for y in reversed(d.ys))
+        [t] = done
+        return t
 
     def _repr_html_(self):
 #        return f'<div style="text-align: center;"><span style="color: magenta;">{self.weight()}</span></br>{self.to_nltk()._repr_svg_()}</div>'
@@ -164,6 +315,7 @@ class CFG:
         self.N = {S}    # nonterminals
         self.S = S      # unique start symbol
         self.rules = [] # rules
+        self._caches = {}   # values of the `_rule_property`s; `add` clears it
 
     def __repr__(self):
         return "\n".join(f"{p}" for p in self)
@@ -176,19 +328,27 @@ class CFG:
         V = set()
         cfg = cls(R=semiring, S=start, V=V)
         string = string.replace('->', '→')   # synonym for the arrow
-        for line in string.split('\n'):
-            line = line.strip()
-            if not line or line.startswith(comment): continue
+
+        def skip(text):
+            # text between matched rules may only contain blank and comment lines
+            for line in text.split('\n'):
+                line = line.strip()
+                if line and not line.startswith(comment):
+                    raise ValueError(f'bad input line:\n{line}')
+
+        end = 0
+        for m in _RULE_RE.finditer(string):
+            (w, lhs, rhs) = m.groups()
+            if w.startswith(comment): continue
+            skip(string[end:m.start()])
+            end = m.end()
+            rhs = rhs.split()
+            V.update(x for x in rhs if is_terminal(x))
             try:
-                [(w, lhs, rhs)] = re.findall('(.*):\s*(\S+)\s*→\s*(.*)$', line)
-                lhs = lhs.strip()
-                rhs = rhs.strip().split()
-                for x in rhs:
-                    if is_terminal(x):
-                        V.add(x)
                 cfg.add(semiring.from_string(w), lhs, *rhs)
             except ValueError as e:
-                raise ValueError(f'bad input line:\n{line}')
+                raise ValueError(f'bad input line:\n{m.group(0).strip()}')
+        skip(string[end:])
         return cfg
 
     def __call__(self, input):
@@ -197,13 +357,16 @@ class CFG:
 
     def _parse_chart(self, input):
         "Implements CKY algorithm for evaluating the total weight of the `input` sequence."
-        if not self.in_cnf(): self = self.cnf
-        (nullary, terminal, binary) = self._cnf()
+        if not self._cnf_cache[3]: self = self.cnf
+        if self.R is Real or self.R is Boolean: return self._parse_chart_dense(input)
+        (nullary, terminal, binary, _) = self._cnf_cache
+        binary = [(r.w, r.head, *r.body) for r in binary]
         N = len(input)
+        S = self.S
         # nullary rule
         c = self.R.chart()
         for i in range(N+1):
-            c[i,self.S,i] += nullary
+            c[i,S,i] += nullary
         # preterminal rules
         for i in range(N):
             for r in terminal[input[i]]:
@@ -213,19 +376,118 @@ class CFG:
             for i in range(N - span + 1):
                 k = i + span
                 for j in range(i + 1, k):
-                    for r in binary:
-                        X, [Y, Z] = r.head, r.body
-                        c[i,X,k] +=  r.w * c[i,Y,j] * c[j,Z,k]
+                    for w, X, Y, Z in binary:
+                        c[i,X,k] +=  w * c[i,Y,j] * c[j,Z,k]
+        return c
+
+    def _parse_chart_dense(self, input):
+        """
+        Vectorized CKY for the real and boolean semirings.  The chart is a dense
+        array `c[i,X,k]`; each span is filled in by a single tensor contraction
+        over the split points `j` and all binary rules at once.
+        """
+        R = self.R
+        (sym2id, nullary, terminal, Xs, Ys, Zs, ws) = self._cnf_arrays
+        N = len(input)
+        if R is Boolean:
+            c = self._bitset_cky(input)
+        elif _compile.HAS_NUMBA:
+            empty = (np.zeros(0, dtype=int), np.zeros(0))
+            pre = [terminal.get(a, empty) for a in input]
+            c = _compile._cky_njit(
+                Xs, Ys, Zs, ws,
+                np.cumsum([0] + [len(h) for h, _ in pre]),
+                np.concatenate([h for h, _ in pre] + [empty[0]]),
+                np.concatenate([w for _, w in pre] + [empty[1]]),
+                N, len(sym2id),
+            )
+        else:
+            c = self._dense_cky(input)
+        # nullary rule
+        c[np.arange(N+1), sym2id[self.S], np.arange(N+1)] += nullary.score
+        return ArrayChart(R, c.astype(R.dtype), index=(None, sym2id, None))
+
+    def _dense_cky(self, input):
+        (sym2id, _, terminal, Xs, Ys, Zs, ws) = self._cnf_arrays
+        N = len(input)
+        c = np.zeros((N+1, len(sym2id), N+1))
+        # preterminal rules
+        for i in range(N):
+            if input[i] in terminal:
+                heads, w = terminal[input[i]]
+                np.add.at(c[i,:,i+1], heads, w)
+        # binary rules
+        for span in range(2, N + 1):
+            I = np.arange(N - span + 1)
+            J = I[:,None] + np.arange(1, span)                   # split points
+            K = I + span
+            A = c[I[:,None,None], Ys[None,:,None], J[:,None,:]]    # c[i,Y,j]
+            B = c[J[:,None,:], Zs[None,:,None], K[:,None,None]]    # c[j,Z,k]
+            np.add.at(c, (I[:,None], Xs[None,:], K[:,None]), np.einsum('irj,irj->ir', A, B) * ws)
         return c
 
+    @_rule_property
+    def _cnf_bitsets(self):
+        """
+        Boolean version of `_cnf_arrays`: sets of nonterminals are bitsets packed
+        into `nw` 64-bit words.  Binary rules are grouped by their body `(Y, Z)`,
+        with `heads[g]` the bitset of the heads of group `g`.
+        """
+        (sym2id, _, terminal, Xs, Ys, Zs, _) = self._cnf_arrays
+        nw = (len(sym2id) + 63) // 64
+        def bitset(ids):
+            b = np.zeros(nw, dtype=np.uint64)
+            np.bitwise_or.at(b, ids >> 6, np.left_shift(np.uint64(1), (ids & 63).astype(np.uint64)))
+            return b
+        term = {a: bitset(h) for a, (h, _) in terminal.items()}
+        groups = defaultdict(list)
+        for X, Y, Z in zip(Xs.tolist(), Ys.tolist(), Zs.tolist()):
+            groups[Y, Z].append(X)
+        gY = np.array([Y for Y, _ in groups], dtype=int)
+        gZ = np.array([Z for _, Z in groups], dtype=int)
+        heads = np.array([bitset(np.array(Xs)) for Xs in groups.values()], dtype=np.uint64).reshape(-1, nw)
+        return (nw, term, gY, gZ, heads)
+
+    def _bitset_cky(self, input):
+        """
+        CKY for the boolean semiring where each chart cell `cell[i,k]` is the
+        bitset of nonterminals that derive `input[i:k]`; returns the unpacked
+        boolean array `c[i,X,k]`.
+        """
+        (sym2id, _, _, _, _, _, _) = self._cnf_arrays
+        (nw, term, gY, gZ, heads) = self._cnf_bitsets
+        N = len(input)
+        cell = np.zeros((N+1, N+1, nw), dtype=np.uint64)
+        # preterminal rules
+        for i in range(N):
+            if input[i] in term:
+                cell[i,i+1] = term[input[i]]
+        # binary rules
+        Yw, Yb = gY >> 6, (gY & 63).astype(np.uint64)
+        Zw, Zb = gZ >> 6, (gZ & 63).astype(np.uint64)
+        one = np.uint64(1)
+        for span in range(2, N + 1):
+            I = np.arange(N - span + 1)
+            J = I[:,None] + np.arange(1, span)                   # split points
+            K = I + span
+            left = (cell[I[:,None], J][..., Yw] >> Yb) & one     # is Y in cell[i,j]?
+            right = (cell[J, K[:,None]][..., Zw] >> Zb) & one    # is Z in cell[j,k]?
+            i, g = np.nonzero((left & right).any(axis=1))       # span i has a split for group g
+            new = np.zeros((len(I), nw), dtype=np.uint64)
+            np.bitwise_or.at(new, i, heads[g])
+            cell[I, K] = new
+        # unpack
+        bits = np.unpackbits(cell.astype('<u8').view(np.uint8), axis=-1, bitorder='little')[..., :len(sym2id)]
+        return bits.transpose(0, 2, 1).astype(bool)
+
     def language(self, depth):
         "Enumerate strings generated by this cfg by derivations up to a the given `depth`."
         lang = self.R.chart()
         for d in self.derivations(self.S, depth):
-            lang[d.Yield()] += d.weight()
+            lang[d.Yield()] += d.weight()   # computed when `d` was built
         return lang
 
-    @cached_property
+    @_rule_property
     def rhs(self):
         rhs = defaultdict(list)
         for r in self:
@@ -259,12 +521,23 @@ class CFG:
         self.N.add(head)
         r = Rule(w, head, body)
         self.rules.append(r)
+        self._caches.clear()
         return r
 
+    def _add_many(self, rules):
+        "Add each `Rule` in `rules`, as `add` would, clearing the caches once."
+        zero = self.R.zero
+        rules = [r for r in rules if r.w != zero]   # skip rules with weight zero
+        self.N.update([r.head for r in rules])
+        self.rules.extend(rules)
+        self._caches.clear()
+
     def rename(self, f):
         new = self.spawn(S = f(self.S))
+        add = new.add
+        is_terminal = self.V.__contains__
         for r in self:
-            new.add(r.w, f(r.head), *((y if self.is_terminal(y) else f(y)
+            add(r.w, f(r.head), *((y if is_terminal(y) else f(y)
                                        for y in r.body)))
         return new
 
@@ -285,13 +558,22 @@ class CFG:
                     colors.mark(r in G),
                     r,
                 )
-        assert not throw or Counter(self.rules) == Counter(other.rules), \
+        assert not throw or _same_rules(self.rules, other.rules), \
             f'\n\nhave=\n{str(self)}\nwant=\n{str(other)}'
 
     def treesum(self, **kwargs):
         return self.agenda()[self.S]
 
+    # `trim` uses the bitset implementation on grammars with at least this many rules
+    _bitset_trim_min_rules = 1000
+
     def trim(self, bottomup_only=False):
+        if len(self.rules) >= self._bitset_trim_min_rules:
+            return self._trim(self._trim_symbols_bitset(bottomup_only))
+        else:
+            return self._trim(self._trim_symbols(bottomup_only))
+
+    def _trim_symbols(self, bottomup_only):
 
         C = set(self.V)
         C.update(e.head for e in self.rules if len(e.body) == 0)
@@ -312,7 +594,7 @@ class CFG:
                         C.add(e.head)
                         agenda.add(e.head)
 
-        if bottomup_only: return self._trim(C)
+        if bottomup_only: return C
 
         T = {self.S}
         agenda.update(T)
@@ -325,16 +607,65 @@ class CFG:
                         T.add(b)
                         agenda.add(b)
 
-        return self._trim(T)
+        return T
+
+    @_rule_property
+    def _body_bits(self):
+        "Bitset (rows of uint64 words) of the symbols in each rule's body."
+        (sym2id, heads, body_off, body_flat) = self._arrays
+        rule = np.repeat(np.arange(len(heads)), np.diff(body_off))
+        bits = np.zeros((len(heads), (len(sym2id) + 63) // 64), dtype=np.uint64)
+        np.bitwise_or.at(bits, (rule, body_flat // 64), np.uint64(1) << (body_flat % 64).astype(np.uint64))
+        return bits
+
+    def _trim_symbols_bitset(self, bottomup_only):
+        """
+        Same as `_trim_symbols`, but each round of the fixpoint updates all
+        rules at once with bitwise operations on the `_body_bits` rows.
+        """
+        (sym2id, heads, body_off, _) = self._arrays
+        bits = self._body_bits
+        ids = np.arange(len(sym2id))
+        word, bit = ids // 64, np.uint64(1) << (ids % 64).astype(np.uint64)
+
+        def pack(mask):
+            words = np.zeros(bits.shape[1], dtype=np.uint64)
+            np.bitwise_or.at(words, word[mask], bit[mask])
+            return words
+
+        # bottom-up: a head is built once all the symbols in its body are built
+        C = np.zeros(len(sym2id), dtype=bool)
+        C[[sym2id[a] for a in self.V]] = True
+        C[heads[np.diff(body_off) == 0]] = True
+        while True:
+            covered = ~C[heads] & ~np.any(bits & ~pack(C), axis=1)
+            if not covered.any(): break
+            C[heads[covered]] = True
+
+        if not bottomup_only:
+            # top-down: the built symbols in the body of a rule whose head is reachable
+            Cw = pack(C)
+            T = (ids == sym2id[self.S])
+            frontier = T
+            while frontier.any():
+                reach = np.bitwise_or.reduce(bits[frontier[heads]], axis=0) & Cw
+                frontier = ((reach[word] & bit) != 0) & ~T
+                T = T | frontier
+            C = T
+
+        id2sym = list(sym2id)
+        return {id2sym[i] for i in np.flatnonzero(C)}
 
     def cotrim(self):
         return self.trim(bottomup_only=True)
 
     def _trim(self, symbols):
         new = self.spawn()
+        add = new.add
+        zero = self.R.zero
         for p in self:
-            if p.head in symbols and p.w != self.R.zero and set(p.body) <= symbols:
-                new.add(p.w, p.head, *p.body)
+            if p.head in symbols and p.w != zero and symbols.issuperset(p.body):
+                add(p.w, p.head, *p.body)
         return new
 
     def derivations(self, X, H):
@@ -348,41 +679,59 @@ class CFG:
             return
 
         else:
-            for r in self.rhs[X]:
-                for ys in self._derivations_list(r.body, H-1):
-                    yield Derivation(r, X, *ys)
-
-    def _derivations_list(self, X, H):
-        if len(X) == 0:
-            yield ()
+            (sym2id, off, rule_ids) = self._rhs_csr
+            h = sym2id.get(X)
+            if h is None: return
+            rules = self.rules
+            out = []
+            for i in rule_ids[off[h]:off[h+1]]:
+                r = rules[i]
+                for _ in self._derivations_list(r.body, 0, H-1, out):
+                    yield Derivation(r, X, *out)
+
+    def _derivations_list(self, body, i, H, out):
+        "Extend `out` (in place) with a derivation of each of `body[i:]`."
+        if i == len(body):
+            yield
         else:
-            for x in self.derivations(X[0], H):
-                for xs in self._derivations_list(X[1:], H):
-                    yield (x, *xs)
+            for x in self.derivations(body[i], H):
+                out.append(x)
+                yield from self._derivations_list(body, i+1, H, out)
+                out.pop()
 
     def derivations_of(self, s):
         "Enumeration of derivations with yield `s`"
 
+        is_terminal = self.V.__contains__
+        (sym2id, off, rule_ids) = self._rhs_csr
+        rules = self.rules
+
         def p(X,I,K):
-            if self.is_terminal(X):
+            if is_terminal(X):
                 if K-I == 1 and s[I] == X:
                     yield X
                 else:
                     return
             else:
-                for r in self.rhs[X]:
-                    for ys in ps(r.body, I, K):
-                        yield Derivation(r, X, *ys)
-
-        def ps(X,I,K):
-            if len(X) == 0:
+                h = sym2id.get(X)
+                if h is None: return
+                out = []
+                for i in rule_ids[off[h]:off[h+1]]:
+                    r = rules[i]
+                    for _ in ps(r.body, 0, I, K, out):
+                        yield Derivation(r, X, *out)
+
+        def ps(X,i,I,K,out):
+            "Extend `out` (in place) with derivations of `X[i:]` with yield `s[I:K]`."
+            if i == len(X):
                 if K-I == 0:
-                    yield ()
+                    yield
             else:
                 for J in range(I, K+1):
-                    for x in p(X[0], I, J):
-                        for xs in ps(X[1:], J, K):
-                            yield (x, *xs)
+                    for x in p(X[i], I, J):
+                        out.append(x)
+                        yield from ps(X, i+1, J, K, out)
+                        out.pop()
 
         return p(self.S, 0, len(s))
 
@@ -392,22 +741,65 @@ class CFG:
     def _lehmann(self, N, W):
         "Lehmann's (1977) algorithm."
 
+        if self.R is Real or self.R is Log or self.R is Boolean:
+            try:
+                return self._lehmann_dense(N, W)
+            except np.linalg.LinAlgError:   # singular; the star of some cycle diverges
+                pass
+
+        chart = self.R.chart
         V = W.copy()
         U = W.copy()
 
         for j in N:
             V, U = U, V
-            V = self.R.chart()
+            V = chart()
             s = U[j, j].star()
             for i in N:
+                Uij = U[i, j]
                 for k in N:
                     # i ➙ j ⇝ j ➙ k
-                    V[i, k] = U[i, k] + U[i, j] * s * U[j, k]
+                    V[i, k] = U[i, k] + Uij * s * U[j, k]
 
         # add paths of length zero
+        one = self.R.one
         for i in N:
-            V[i, i] += self.R.one
+            V[i, i] += one
+
+        return V
+
+    def _lehmann_dense(self, N, W):
+        """
+        Same result as `_lehmann`, computed as the matrix inverse `(I - W)⁻¹`
+        for the real and log semirings and as the reflexive-transitive closure
+        (Warshall's algorithm on boolean rows) for the boolean semiring.
+        """
+        R = self.R
+        N = list(N)
+        n = len(N)
+        idx = {X: i for i, X in enumerate(N)}
+        M = np.zeros((n, n), dtype=bool if R is Boolean else float)
+        for (i, k), w in W.items():
+            if i in idx and k in idx:
+                M[idx[i], idx[k]] = np.exp(w.score) if R is Log else w.score
+
+        if R is Boolean:
+            M |= np.eye(n, dtype=bool)
+            for j in range(n):
+                # i ➙ j ⇝ j ➙ k
+                M[M[:, j]] |= M[j]
+            nonzero = M
+        else:
+            M = np.linalg.solve(np.eye(n) - M, np.eye(n))
+            if R is Log:
+                nonzero = M > 0
+                M = np.log(M, where=nonzero, out=np.full_like(M, -np.inf))
+            else:
+                nonzero = M != 0
 
+        V = R.chart()
+        for i, k in np.argwhere(nonzero):
+            V[N[i], N[k]] = _from_float(R, M[i, k])
         return V
 
     def unaryremove(self):
@@ -416,9 +808,10 @@ class CFG:
         """
 
         # compute unary chain weights
+        is_terminal = self.V.__contains__
         A = self.R.chart()
         for p in self.rules:
-            if len(p.body) == 1 and self.is_nonterminal(p.body[0]):
+            if len(p.body) == 1 and not is_terminal(p.body[0]):
                 A[p.body[0], p.head] += p.w
 
         W = self._lehmann(self.N, A)
@@ -426,7 +819,7 @@ class CFG:
         new = self.spawn()
         for p in self.rules:
             X, body = p
-            if len(body) == 1 and self.is_nonterminal(body[0]): continue
+            if len(body) == 1 and not is_terminal(body[0]): continue
             for Y in self.N:
                 new.add(W[X,Y]*p.w, Y, *body)
 
@@ -449,11 +842,93 @@ class CFG:
         empty string starting from that nonterminal.
         """
         ecfg = self.spawn(V=set())
+        V = self.V
         for p in self:
-            if not any(self.is_terminal(y) for y in p.body):
+            if V.isdisjoint(p.body):
                 ecfg.add(p.w, p.head, *p.body)
+        if self.R is Real:
+            null_weight = ecfg._null_weight_dense()
+            if null_weight is not None: return null_weight
         return ecfg.agenda()
 
+    def _null_weight_dense(self, tol=1e-12, max_iters=10_000):
+        """
+        Fixed-point iteration for the value of each nonterminal in a grammar
+        with no terminals and bodies of length at most two (e.g., after
+        `binarize`), vectorized by arity.  Returns `None` if some body is longer
+        or the iteration does not converge, so that the caller can fall back to
+        `agenda`.
+        """
+        (sym2id, heads, body_off, body_flat) = self._arrays
+        arity = np.diff(body_off)
+        if len(arity) and arity.max() > 2: return None
+        ws = self._scores
+        n = len(sym2id)
+        start = body_off[:-1]
+
+        b0 = np.bincount(heads[arity == 0], weights=ws[arity == 0], minlength=n)
+        u = arity == 1
+        u_heads, u_body, u_ws = heads[u], body_flat[start[u]], ws[u]
+        b = arity == 2
+        b_heads, b_left, b_right, b_ws = heads[b], body_flat[start[b]], body_flat[start[b]+1], ws[b]
+
+        x = np.zeros(n)
+        for _ in range(max_iters):
+            new = (b0
+                   + np.bincount(u_heads, weights=u_ws * x[u_body], minlength=n)
+                   + np.bincount(b_heads, weights=b_ws * x[b_left] * x[b_right], minlength=n))
+            if np.abs(new - x).max(initial=0) <= tol: break
+            x = new
+        else:
+            return None
+
+        chart = self.R.chart()
+        for X, i in sym2id.items():
+            if new[i] != 0:
+                chart[X] = Real(float(new[i]))
+        return chart
+
+    def _slash_null_weight_dense(self):
+        """
+        Real-semiring null weights of the slashed symbols, `(I - W)⁻¹ v` where
+        `W` holds the unary slash rules and `v` the nullary ones.  Both are read
+        off `_arrays` and indexed by slashed symbol only.  Returns `None` if
+        `I - W` is singular, so that the caller can fall back to `_lehmann`.
+        """
+        (sym2id, heads, body_off, body_flat) = self._arrays
+        ws = self._scores
+        syms = list(sym2id)
+        is_slash = np.array([type(x) is Slash for x in syms], dtype=bool)
+        arity = np.diff(body_off)
+        nullary = arity == 0
+
+        slashed = is_slash[heads]
+        # This optimized method assumes that the grammar prior to
+        # transformation is nullary free.
+        assert slashed[nullary].all(), 'grammar has a nullary non-slash rule'
+
+        ids = np.flatnonzero(is_slash)
+        pos = np.full(len(syms), -1)
+        pos[ids] = np.arange(len(ids))
+
+        u = slashed & (arity == 1)
+        body0 = body_flat[body_off[:-1][u]]
+        assert is_slash[body0].all()
+        W = np.zeros((len(ids), len(ids)))
+        np.add.at(W, (pos[heads[u]], pos[body0]), ws[u])
+
+        z = slashed & nullary
+        v = np.bincount(pos[heads[z]], weights=ws[z], minlength=len(ids))
+
+        try:
+            x = np.linalg.solve(np.eye(len(ids)) - W, v)
+        except np.linalg.LinAlgError:
+            return None
+        null_weight = self.R.chart()
+        for i in np.flatnonzero(x):
+            null_weight[syms[ids[i]]] = Real(float(x[i]))
+        return null_weight
+
     def null_weight_start(self):
         return self.null_weight()[self.S]
 
@@ -476,41 +951,75 @@ class CFG:
         # been run before.  So we run it rather than leaving it up to chance.
         assert self.S not in {y for r in self for y in r.body}
 
+        zero = self.R.zero
+        S = self.S
+
         def f(x):
             "Rename nonterminal if necessary"
-            if null_weight[x] == self.R.zero or x == self.S:   # not necessary; keep old name
+            if null_weight[x] == zero or x == S:   # not necessary; keep old name
                 return x
             else:
                 return rename(x)
 
         rcfg = self.spawn()
-        rcfg.add(null_weight[self.S], self.S)
+        add = rcfg.add
+        add(null_weight[S], S)
 
         if recovery:
             for x in self.N:
                 if f(x) == x: continue
-                rcfg.add(null_weight[x], x)
-                rcfg.add(self.R.one, x, f(x))
+                add(null_weight[x], x)
+                add(self.R.one, x, f(x))
 
+        drop_nullable = self._drop_nullable
         for r in self:
-
             if len(r.body) == 0: continue  # drop nullary rule
-
-            for B in product([0, 1], repeat=len(r.body)):
-                v, new_body = r.w, []
-
-                for i, b in enumerate(B):
-                    if b:
-                        v *= null_weight[r.body[i]]
-                    else:
-                        new_body.append(f(r.body[i]))
-
-                # exclude the cases that would be new nullary rules!
-                if len(new_body) > 0:
-                    rcfg.add(v, f(r.head), *new_body)
+            X = f(r.head)
+            for w, body in drop_nullable(r, null_weight, f, zero):
+                add(w, X, *body)
 
         return rcfg
 
+    @staticmethod
+    def _drop_nullable(r, null_weight, f, zero):
+        """
+        Yield the `(weight, body)` variants of the (non-nullary) rule `r` that
+        drop some of its nullable positions; the remaining symbols are renamed
+        by `f`.  Variants with an empty body are excluded.
+        """
+        nw = [null_weight[y] for y in r.body]
+        new_names = [f(y) for y in r.body]
+        full = (1 << len(r.body)) - 1
+
+        # Only the positions with nonzero null weight can be dropped from
+        # the body, so we enumerate the subsets `B` of the bitmask
+        # `nullable` (in increasing order); bit i of B means `r.body[i]`
+        # is dropped.  `v[B]` is the weight of the rule, times the null
+        # weights of the dropped positions.
+        nullable = 0
+        for i, w in enumerate(nw):
+            if w != zero: nullable |= 1 << i
+
+        v = {0: r.w}
+        B = 0
+        while True:
+            if B:
+                top = B.bit_length() - 1
+                v[B] = v[B ^ (1 << top)] * nw[top]
+
+            # exclude the cases that would be new nullary rules!
+            keep = full & ~B
+            if keep:
+                new_body = []
+                while keep:
+                    lsb = keep & -keep
+                    new_body.append(new_names[lsb.bit_length() - 1])
+                    keep ^= lsb
+                yield v[B], new_body
+
+            if B == nullable: break
+            B = (B - nullable) & nullable
+
     def separate_start(self):
         "Ensure that the start symbol does not appear on the RHS of any rule."
         # create a new start symbol if the current one appears on the rhs of any existing rule
@@ -538,36 +1047,48 @@ class CFG:
                 _preterminal[x] = y
             return y
 
+        add = new.add
+        is_terminal = self.V.__contains__
         for r in self:
-            if len(r.body) == 1 and self.is_terminal(r.body[0]):
-                new.add(r.w, r.head, *r.body)
+            if len(r.body) == 1 and is_terminal(r.body[0]):
+                add(r.w, r.head, *r.body)
             else:
-                new.add(r.w, r.head, *((preterminal(y).head if y in self.V else y) for y in r.body))
+                add(r.w, r.head, *((preterminal(y).head if is_terminal(y) else y) for y in r.body))
 
         return new
 
     def binarize(self):
         new = self.spawn()
+        add = new.add
+        fold = self._fold
 
         stack = list(self.rules)
+        pop = stack.pop
+        extend = stack.extend
         while stack:
-            p = stack.pop()
+            p = pop()
             if len(p.body) <= 2:
-                new.add(p.w, p.head, *p.body)
+                add(p.w, p.head, *p.body)
             else:
-                stack.extend(self._fold(p, [(0, 1)]))
+                extend(fold(p, [(0, 1)]))
 
         return new
 
+    @_rule_property
+    def _binarized(self):
+        "`binarize()`, computed once per grammar; callers must not modify it."
+        return self.binarize()
+
     def _fold(self, p, I):
 
         # new productions
+        one = self.R.one
         P, heads = [], []
         for (i, j) in I:
             head = _gen_nt()
             heads.append(head)
             body = p.body[i:j+1]
-            P.append(Rule(self.R.one, head, body))
+            P.append(Rule(one, head, body))
 
         # new "head" production
         body = tuple()
@@ -580,14 +1101,109 @@ class CFG:
 
         return P
 
-    @cached_property
+    # `cnf` streams the rules through `_to_cnf_fused`; set to False to run the
+    # staged pipeline of grammar transformations instead (e.g., for debugging).
+    _fused_cnf = True
+
+    @_rule_property
     def cnf(self):
-        new = self.separate_terminals().binarize().nullaryremove().unaryremove().trim()
+        if self._fused_cnf:
+            new = self._to_cnf_fused()
+        else:
+            new = self.separate_terminals().binarize().nullaryremove().unaryremove().trim()
         assert new.in_cnf()
         return new
 
+    def _to_cnf_fused(self):
+        """
+        Same grammar as `separate_terminals().binarize().nullaryremove().unaryremove().trim()`
+        (up to the names of generated nonterminals), computed on plain lists of
+        rules rather than by building each of the intermediate grammars.
+        """
+        one = self.R.one
+        zero = self.R.zero
+        is_terminal = self.V.__contains__
+
+        # separate terminals and binarize
+        rules = []
+        append = rules.append
+        _preterminal = {}
+        def preterminal(x):
+            y = _preterminal.get(x)
+            if y is None:
+                y = _preterminal[x] = _gen_nt()
+                append(Rule(one, y, (x,)))
+            return y
+
+        fold = self._fold
+        for r in self:
+            if len(r.body) == 1 and is_terminal(r.body[0]):
+                append(r)
+                continue
+            stack = [Rule(r.w, r.head, tuple(preterminal(y) if is_terminal(y) else y for y in r.body))]
+            while stack:
+                p = stack.pop()
+                if len(p.body) <= 2:
+                    append(p)
+                else:
+                    stack.extend(fold(p, [(0, 1)]))
+
+        # separate start
+        S = self.S
+        if any(S in p.body for p in rules):
+            S = _gen_nt(self.S)
+            append(Rule(one, S, (self.S,)))
+
+        # null weights (the only analysis that needs the whole grammar)
+        ecfg = self.spawn(S=S, V=set())
+        V = self.V
+        for p in rules:
+            if V.isdisjoint(p.body):
+                ecfg.add(p.w, p.head, *p.body)
+        null_weight = ecfg._null_weight_dense() if self.R is Real else None
+        if null_weight is None: null_weight = ecfg.agenda()
+
+        def f(x):
+            if null_weight[x] == zero or x == S:
+                return x
+            else:
+                return f'${x}'
+
+        # nullary removal; collect the unary chains along the way
+        N = {S}
+        out = []
+        A = self.R.chart()
+        if null_weight[S] != zero:
+            out.append((null_weight[S], S, ()))
+        drop_nullable = self._drop_nullable
+        for r in rules:
+            if len(r.body) == 0: continue
+            X = f(r.head)
+            for w, body in drop_nullable(r, null_weight, f, zero):
+                if w == zero: continue
+                N.add(X)
+                if len(body) == 1 and not is_terminal(body[0]):
+                    A[body[0], X] += w
+                else:
+                    out.append((w, X, body))
+
+        # unary removal
+        closure = defaultdict(list)
+        for (X, Y), w in self._lehmann(N, A).items():
+            if w != zero:
+                closure[X].append((Y, w))
+
+        new = self.spawn(S=S)
+        add = new.add
+        for w, X, body in out:
+            for Y, u in closure[X]:
+                add(u*w, Y, *body)
+
+        return new.trim()
+
     # TODO: make CNF grammars a speciazed subclass of CFG.
     def _cnf(self):
+        is_terminal = self.V.__contains__
         nullary = self.R.zero
         terminal = defaultdict(list)
         binary = []
@@ -597,27 +1213,58 @@ class CFG:
                 assert r.head == self.S
             elif len(r.body) == 1:
                 terminal[r.body[0]].append(r)
-                assert self.is_terminal(r.body[0])
+                assert is_terminal(r.body[0])
             else:
                 assert len(r.body) == 2
                 binary.append(r)
-                assert self.is_nonterminal(r.body[0])
-                assert self.is_nonterminal(r.body[1])
+                assert not is_terminal(r.body[0])
+                assert not is_terminal(r.body[1])
         return (nullary, terminal, binary)
 
-    def in_cnf(self):
-        """check if grammar is in cnf"""
+    @_rule_property
+    def _cnf_arrays(self):
+        "Integer-indexed version of `_cnf` for the real and boolean semirings."
+        (nullary, terminal, binary, _) = self._cnf_cache
+        sym2id = {}
+        for X in self.N:
+            sym2id.setdefault(X, len(sym2id))
+        for r in binary:
+            for Y in r.body:
+                sym2id.setdefault(Y, len(sym2id))
+        term = {
+            a: (np.array([sym2id[r.head] for r in rs], dtype=int),
+                np.array([float(r.w.score) for r in rs]))
+            for a, rs in terminal.items()
+        }
+        Xs = np.array([sym2id[r.head] for r in binary], dtype=int)
+        Ys = np.array([sym2id[r.body[0]] for r in binary], dtype=int)
+        Zs = np.array([sym2id[r.body[1]] for r in binary], dtype=int)
+        ws = np.array([float(r.w.score) for r in binary])
+        return (sym2id, nullary, term, Xs, Ys, Zs, ws)
+
+    @_rule_property
+    def _cnf_cache(self):
+        """
+        `(nullary, terminal, binary, in_cnf)`, computed once per grammar so that
+        repeated calls to `__call__` do not rescan the rules.  The first three
+        entries are `None` when the grammar is not in CNF.
+        """
+        is_terminal = self.V.__contains__
         for r in self:
             assert r.head in self.N
             if len(r.body) == 0 and r.head == self.S:
                 continue
-            elif len(r.body) == 1 and self.is_terminal(r.body[0]):
+            elif len(r.body) == 1 and is_terminal(r.body[0]):
                 continue
-            elif len(r.body) == 2 and all(self.is_nonterminal(y) and y != self.S for y in r.body):
+            elif len(r.body) == 2 and all(not is_terminal(y) and y != self.S for y in r.body):
                 continue
             else:
-                return False
-        return True
+                return (None, None, None, False)
+        return (*self._cnf(), True)
+
+    def in_cnf(self):
+        """check if grammar is in cnf"""
+        return self._cnf_cache[3]
 
     def unfold(self, i, k):
         assert isinstance(i, int) and isinstance(k, int)
@@ -656,47 +1303,199 @@ class CFG:
         """
         return self.lc_generalized(Ps=Ps, Xs=self.V | self.N, filter=filter)
 
+    @_rule_property
+    def _arrays(self):
+        """
+        The rules packed into flat arrays: symbol ids `sym2id`, `heads`, and
+        the bodies `body_flat[body_off[r]:body_off[r+1]]` of each rule `r`.
+        """
+        sym2id = {}
+        for x in self.V: sym2id.setdefault(x, len(sym2id))
+        for X in self.N: sym2id.setdefault(X, len(sym2id))
+        intern = sym2id.setdefault
+        heads = []
+        body_off = [0]
+        body_flat = []
+        for r in self.rules:
+            heads.append(sym2id[r.head])
+            body_flat.extend([intern(y, len(sym2id)) for y in r.body])
+            body_off.append(len(body_flat))
+        return (sym2id,
+                np.array(heads, dtype=int),
+                np.array(body_off, dtype=int),
+                np.array(body_flat, dtype=int))
+
+    @_rule_property
+    def _is_terminal_arr(self):
+        "Boolean mask over the symbol ids of `_arrays` that marks the terminals."
+        (sym2id, _, _, _) = self._arrays
+        mask = np.zeros(len(sym2id), dtype=bool)
+        mask[[sym2id[a] for a in self.V]] = True
+        return mask
+
+    @_rule_property
+    def _scores(self):
+        "Rule weights as floats (real and boolean semirings only)."
+        return np.array([float(r.w.score) for r in self.rules])
+
+    @_rule_property
+    def _routing(self):
+        """
+        Compressed (CSR) index from each symbol `u` to the (rule, position)
+        pairs where `u` appears in a body: `rule[off[u]:off[u+1]]`,
+        `pos[off[u]:off[u+1]]`.
+        """
+        (sym2id, heads, body_off, body_flat) = self._arrays
+        lens = np.diff(body_off)
+        rule = np.repeat(np.arange(len(heads)), lens)
+        pos = np.arange(len(body_flat)) - np.repeat(body_off[:-1], lens)
+        order = np.argsort(body_flat, kind='stable')
+        off = np.searchsorted(body_flat[order], np.arange(len(sym2id) + 1))
+        return (off, rule[order], pos[order])
+
+    @_rule_property
+    def _rhs_csr(self):
+        """
+        Compressed (CSR) index from each symbol id `h` to the rules with head
+        `h`: `rules[i]` for `i` in `rule_ids[off[h]:off[h+1]]` (as lists, for
+        the pure-Python enumerators).
+        """
+        (sym2id, heads, _, _) = self._arrays
+        rule_ids = np.argsort(heads, kind='stable')
+        off = np.searchsorted(heads[rule_ids], np.arange(len(sym2id) + 1))
+        return (sym2id, off.tolist(), rule_ids.tolist())
+
+    def _agenda_init(self):
+        "Initial agenda items (symbol ids, in the order they are added)."
+        (sym2id, heads, body_off, _) = self._arrays
+        nullary = heads[np.diff(body_off) == 0].tolist()
+        return [sym2id[a] for a in self.V], nullary
+
+    def _agenda_compiled(self, max_iters=10_000_000):
+        """
+        Semi-naive evaluation for the boolean semiring (see
+        `_compile._agenda_njit`).  Returns `None` if the kernel stops after
+        `max_iters` pops, so that the caller can fall back to `agenda`'s loop.
+        """
+        R = self.R
+        (sym2id, heads, body_off, body_flat) = self._arrays
+        (routing_off, routing_rule, routing_pos) = self._routing
+        ws = self._scores
+
+        terminals, nullary = self._agenda_init()
+        change = np.zeros(len(sym2id))
+        change[terminals] = 1
+        np.add.at(change, nullary, ws[np.diff(body_off) == 0])
+        init = list(dict.fromkeys(terminals + nullary))
+
+        old, done = _compile._agenda_njit(routing_off, routing_rule, routing_pos, body_off, body_flat,
+                                          ws, heads, change, np.array(init, dtype=int), max_iters)
+        if not done: return None
+
+        chart = R.chart()
+        for x, i in sym2id.items():
+            if old[i] != 0:
+                chart[x] = _from_float(R, old[i])
+        return chart
+
     def agenda(self, tol=1e-12):
         "Agenda-based semi-naive evaluation"
-        old = self.R.chart()
-
-        # precompute the mapping from updates to where they need to go
-        routing = defaultdict(list)
-        for r in self.rules:
-            for k in range(len(r.body)):
-                routing[r.body[k]].append((r, k))
+        # The real semiring stays on the prioritized loop below, which
+        # converges in far fewer updates than the kernel's LIFO order.
+        if _compile.HAS_NUMBA and self.R is Boolean:
+            chart = self._agenda_compiled()
+            if chart is not None: return chart
 
-        change = self.R.chart()
-        for a in self.V:
-            change[a] += self.R.one
+        R = self.R
+        (sym2id, heads, body_off, body_ids) = self._arrays
+        (routing_off, routing_rule, routing_pos) = self._routing
+        heads = heads.tolist()
+        body_ids = body_ids.tolist()
+        nullary_rules = np.flatnonzero(np.diff(body_off) == 0).tolist()
+        body_off = body_off.tolist()
+
+        # precompute the mapping from updates to where they need to go: for
+        # each (rule, k) pair in the routing index, the rule weight, its head,
+        # and a template for its body.  In the template, -1 marks position k
+        # (multiplied by the update `v`), -2 marks an earlier occurrence of the
+        # same symbol (multiplied by its `new` value), and any other entry `y`
+        # is multiplied by `old[y]`.
+        routing = []
+        for r, k in zip(routing_rule.tolist(), routing_pos.tolist()):
+            body = body_ids[body_off[r]:body_off[r+1]]
+            u = body[k]
+            template = tuple(-1 if j == k else -2 if (j < k and y == u) else y
+                             for j, y in enumerate(body))
+            routing.append((self.rules[r].w, heads[r], template))
+        routing_off = routing_off.tolist()
+
+        zero = R.zero
+        one = R.one
+        metric = R.metric
+        old = [zero] * len(sym2id)
+
+        # `change[u]` is the pending update for symbol `u`.  For the real
+        # semiring, the agenda is a heap that pops the largest pending update
+        # first; entries are invalidated by bumping `gen[u]` whenever
+        # `change[u]` changes.  Otherwise, it is a FIFO queue of the symbols
+        # with a pending update.
+        change = [None] * len(sym2id)
+        prioritized = R is Real
+        if prioritized:
+            heap = []
+            gen = [0] * len(sym2id)
+            def push(u):
+                gen[u] += 1
+                heappush(heap, (-abs(change[u].score), gen[u], u))
+            def pop():
+                _, g, u = heappop(heap)
+                return u if g == gen[u] else None   # None: stale entry
+            agenda = heap
+        else:
+            queue = deque()
+            def push(u):
+                queue.append(u)
+            pop = queue.popleft
+            agenda = queue
+
+        def update(u, v):
+            if change[u] is None:
+                change[u] = v
+                push(u)
+            else:
+                change[u] += v
+                if prioritized: push(u)
 
-        for r in self.rules:
-            if len(r.body) == 0:
-                change[r.head] += r.w
+        terminals, nullary = self._agenda_init()
+        for a in terminals:
+            update(a, one)
+        for r, h in zip(nullary_rules, nullary):
+            update(h, self.rules[r].w)
 
-        while len(change) > 0:
-            u,v = change.popitem()
+        while agenda:
+            u = pop()
+            if u is None: continue
+            v = change[u]
+            change[u] = None
 
             new = old[u] + v
 
-            if old[u].metric(new) <= tol: continue
+            if metric(old[u], new) <= tol: continue
 
-            for r, k in routing[u]:
-
-                W = r.w
-                for j in range(len(r.body)):
-                    if u == r.body[j]:
-                        if j < k:    W *= new
-                        elif j == k: W *= v
-                        else:        W *= old[u]
-                    else:
-                        W *= old[r.body[j]]
-
-                change[r.head] += W
+            for W, h, template in routing[routing_off[u]:routing_off[u+1]]:
+                for y in template:
+                    if y == -1:   W *= v
+                    elif y == -2: W *= new
+                    else:         W *= old[y]
+                update(h, W)
 
             old[u] = new
 
-        return old
+        chart = R.chart()
+        for x, i in sym2id.items():
+            if old[i] != zero:
+                chart[x] = old[i]
+        return chart
 
     def naive_bottom_up(self, *, tol=1e-12, timeout=100_000):
 
@@ -715,18 +1514,46 @@ class CFG:
 
     def _bottom_up_step(self, V):
         R = self.R
+        if R is Real: return self._bottom_up_step_real(V)
         one = R.one
+        is_terminal = self.V.__contains__
         U = R.chart()
         for a in self.V:
             U[a] = one
         for p in self.rules:
             update = p.w
             for X in p.body:
-                if self.is_nonterminal(X):
+                if not is_terminal(X):
                     update *= V[X]
             U[p.head] += update
         return U
 
+    def _bottom_up_step_real(self, V):
+        (sym2id, heads, body_off, body_flat) = self._arrays
+        terminals = self._is_terminal_arr
+        x = np.zeros(len(sym2id))
+        for X, v in V.items():
+            i = sym2id.get(X)
+            if i is not None: x[i] = v.score
+        x[terminals] = 1
+
+        # product of each rule's body; rules with empty bodies have product one
+        update = np.ones(len(heads))
+        nonempty = np.diff(body_off) > 0
+        if nonempty.any():
+            update[nonempty] = np.multiply.reduceat(x[body_flat], body_off[:-1][nonempty])
+        update *= self._scores
+
+        u = np.zeros(len(sym2id))
+        np.add.at(u, heads, update)
+        u[terminals] += 1
+
+        id2sym = list(sym2id)
+        U = Real.chart()
+        for i in set(np.flatnonzero(terminals).tolist()) | set(heads.tolist()):
+            U[id2sym[i]] = Real(float(u[i]))
+        return U
+
     #___________________________________________________________________________
     # Left-recursion analysis and elimination methods
 
@@ -777,11 +1604,17 @@ class CFG:
         Return the set of left-recursive rules (i.e., those that appear in any
         cyclical left-recursive block)
         """
-        # this utility flattens the list of sets returned by `find_lr_block`
-        G = self.left_recursion_graph()
-        H = nx.condensation(G)
-        f = H.graph['mapping']
-        return {r for r in self.rules if len(r.body) > 0 and f[r.head] == f[r.body[0]]}
+        # strongly connected components of the left-corner graph (see
+        # `left_recursion_graph`), computed directly on the interned rules
+        (sym2id, heads, body_off, body_flat) = self._arrays
+        nonempty = np.diff(body_off) > 0
+        first = np.full(len(heads), -1)
+        first[nonempty] = body_flat[body_off[:-1][nonempty]]
+        comp = np.array(_scc(len(sym2id), heads[nonempty], first[nonempty]), dtype=int)
+        lr = nonempty.copy()
+        lr[nonempty] = comp[heads[nonempty]] == comp[first[nonempty]]
+        rules = self.rules
+        return {rules[i] for i in np.flatnonzero(lr).tolist()}
 
     def sufficient_Xs(self, Ps):
         """
@@ -799,16 +1632,38 @@ class CFG:
 
 class SlashNames:
 
+    # The symbol chosen for each slashed and frozen name, so that a transform
+    # builds each one once (and checks it against `parent.N` once); equal
+    # symbols within a transform are then also identical.
+    @_cached_property
+    def _slash_names(self):
+        return {}
+
+    @_cached_property
+    def _frozen_names(self):
+        return {}
+
     def _slash(self, X, Y):
-        x = Slash(X, Y, id=0)
-        if x not in self.parent.N: return x
-        return Slash(X, Y, id=self.id)
+        names = self._slash_names
+        k = (X, Y)
+        x = names.get(k)
+        if x is None:
+            x = Slash(X, Y, 0)
+            if x in self.parent.N: x = Slash(X, Y, self.id)
+            names[k] = x
+        return x
 
     def _frozen(self, X):
-        if self.is_terminal(X): return X
-        x = Frozen(X, id=0)
-        if x not in self.parent.N: return x
-        return Frozen(X, id=self.id)
+        names = self._frozen_names
+        x = names.get(X)
+        if x is None:
+            if self.is_terminal(X):
+                x = X
+            else:
+                x = Frozen(X, 0)
+                if x in self.parent.N: x = Frozen(X, self.id)
+            names[X] = x
+        return x
 
     def spawn(self, *, R=None, S=None, V=None):
         return CFG(R=self.R if R is None else R,
@@ -925,7 +1780,9 @@ class GLCT(SlashNames, CFG):
         #frozen = lambda X: X if self.is_terminal(X) else Frozen(X,id)
 
         slash = self._slash; frozen = self._frozen; one = self.R.one
-        add = self.add
+        # rules are collected and added in one batch
+        pending = []
+        emit = pending.append
 
         Xs = set(Xs)
 
@@ -934,30 +1791,55 @@ class GLCT(SlashNames, CFG):
             # `retained` is the set of symbols that appear outside the
             # left-corner paths. These items may need recovery rules.
             retained = {parent.S}
+            is_terminal = parent.V.__contains__
             for p in parent:
                 for X in p.body[int(p in Ps):]:
-                    if parent.is_nonterminal(X):
+                    if not is_terminal(X):
                         retained.add(X)
 
             # Left corner graph over symbols, but only the rules in Ps.
             G = parent._left_recursion_graph(Ps).reverse()
             T = nx.transitive_closure(G, reflexive=True)
 
-            # `den2num` represents {Y: (den ⇝ num) the left edge}
-            den2num = {den: {num for _, num in T.edges(den)} for den in parent.N | parent.V}
-
-            # below is the set of (retained) numerators that are reachable from the denominators
-            useful_num = {num for den in Xs for num in den2num[den] if num in retained}
-
-            # In GLCT, we create a rule for each possible consumer of the left corner
-            num_given_den = lambda den: (den2num.get(den, set()) & retained)
-
-            # den in Xs ~~> mid ~~~> num in retained
-            useful_mid = {mid
-                          for den in Xs
-                          for mid in den2num[den]
-                          for num in den2num[mid]
-                          if num in retained}
+            symbols = parent.N | parent.V
+            if len(symbols) <= self._bitset_filter_max_symbols:
+                (num_given_den, useful_mid) = self._filter_bitset(T, symbols, Xs, retained)
+            else:
+                # `den2num` represents {Y: (den ⇝ num) the left edge}
+                den2num = {den: {num for _, num in T.edges(den)} for den in symbols}
+
+                # In GLCT, we create a rule for each possible consumer of the
+                # left corner; memoized since many rules share a left corner.
+                # (There is no need to order the operands of `&` by size:
+                # CPython's set intersection iterates over the smaller one.)
+                num_cache = {}
+                def num_given_den(den):
+                    ys = num_cache.get(den)
+                    if ys is None:
+                        nums = den2num.get(den)
+                        ys = num_cache[den] = (nums & retained) if nums else _EMPTY
+                    return ys
+
+                # den in Xs ~~> mid ~~~> num in retained.  Each mid is tested
+                # once; `isdisjoint` probes from the smaller set and stops at the
+                # first common element.
+                useful_mid = set()
+                seen = set()
+                for den in Xs:
+                    for mid in den2num[den]:
+                        if mid in seen: continue
+                        seen.add(mid)
+                        if not den2num[mid].isdisjoint(retained):
+                            useful_mid.add(mid)
+
+            # The base case `X/X → ε` ends a slash chain.  Only emit it if it is
+            # used: by the recovery rule `X → ~X X/X`, or by a slashed rule
+            # `X/Z → ⋯ X/X` for some `X → Z ⋯` in Ps.
+            useful_num = {X for X in Xs if X in num_given_den(X)}
+            for p in Ps:
+                (head, body) = p
+                if body[0] in useful_mid and head in num_given_den(body[0]):
+                    useful_num.add(head)
 
         else:
             retained = parent.N
@@ -967,28 +1849,78 @@ class GLCT(SlashNames, CFG):
 
         # base case
         for X in useful_num:
-            add(one, slash(X, X))
+            emit(Rule(one, slash(X, X), ()))
 
         # make slashed and frozen rules
         for p in parent:
             (head, body) = p
             if p not in Ps:
-                add(p.w, frozen(head), *body)
+                emit(Rule(p.w, frozen(head), body))
             else:
-                for Y in num_given_den(body[0]):
-                    if body[0] not in useful_mid: continue
-                    add(p.w, slash(Y, body[0]), *body[1:], slash(Y, head))
-                if body[0] not in Xs:
-                    add(p.w, frozen(head), frozen(body[0]), *body[1:])
+                w = p.w; b0 = body[0]; tail = body[1:]
+                if b0 in useful_mid:
+                    for Y in num_given_den(b0):
+                        emit(Rule(w, slash(Y, b0), (*tail, slash(Y, head))))
+                if b0 not in Xs:
+                    emit(Rule(w, frozen(head), (frozen(b0), *tail)))
+
+        # recovery rules, in one scan over the symbols that need them
+        for X in retained | Xs:
+            if X in Xs:
+                for Y in num_given_den(X):
+                    emit(Rule(one, Y, (frozen(X), slash(Y, X))))
+            else:
+                emit(Rule(one, X, (frozen(X),)))
 
-        # recovery rules
-        for Y in retained - Xs:
-            add(one, Y, frozen(Y))
-        for X in Xs:
-            for Y in num_given_den(X):
-                add(one, Y, frozen(X), slash(Y, X))
+        self._add_many(pending)
 
-    @cached_property
+    # below this many symbols, the filter packs sets of symbols into int bitsets
+    _bitset_filter_max_symbols = 4096
+
+    @staticmethod
+    def _filter_bitset(T, symbols, Xs, retained):
+        """
+        Same `num_given_den` and `useful_mid` as the set-based filter, but the
+        numerators of each denominator (the edges of the transitive closure `T`)
+        and the `retained` symbols are int bitsets over `symbols`, so each
+        intersection is a single `&`.
+        """
+        id2sym = list(symbols)
+        bit = {X: 1 << i for i, X in enumerate(id2sym)}
+
+        den2num = {}
+        for den in id2sym:
+            b = 0
+            for _, num in T.edges(den):
+                b |= bit[num]
+            den2num[den] = b
+
+        keep = 0
+        for X in retained:
+            keep |= bit.get(X, 0)
+
+        def members(b):
+            while b:
+                low = b & -b
+                yield id2sym[low.bit_length() - 1]
+                b ^= low
+
+        num_cache = {}
+        def num_given_den(den):
+            ys = num_cache.get(den)
+            if ys is None:
+                ys = num_cache[den] = frozenset(members(den2num.get(den, 0) & keep))
+            return ys
+
+        # den in Xs ~~> mid ~~~> num in retained
+        mids = 0
+        for den in Xs:
+            mids |= den2num[den]
+        useful_mid = {mid for mid in members(mids) if den2num[mid] & keep}
+
+        return (num_given_den, useful_mid)
+
+    @_cached_property
     def _speculation(self):
         return self.parent.speculate(Xs=self.Xs, Ps=self.Ps, filter=self.filter, id=self.id)
 
@@ -999,66 +1931,117 @@ class GLCT(SlashNames, CFG):
 
     def _mapping(self, d):
         "Helper method; transposes the slash items."
-        if not isinstance(d, Derivation):
-            return d
-        elif isinstance(d.x, Slash):
-            spine = []
-            rests = []
-            curr = d
-            while len(curr.ys) != 0:
-                assert isinstance(curr.x, Slash)
-                spine.append(curr.ys[0].x)
-                rests.append(tuple(map(self._mapping, curr.ys[1:])))
-                curr = curr.ys[0]
-            num = d.x.Y
-            new = tree(self._slash(num, num))
-            for rest, s in zip(rests, spine):
-                new = tree(self._slash(num, s.Y), *rest, new)
-            return new
-        else:
-            return tree(d.x, *map(self._mapping, d.ys))
+        slash = self._slash
+        # (`Slash` and `Derivation` are never subclassed, so the type tests
+        # below are identity checks rather than `isinstance`.)
+        # post-order walk: a node is built once all of its mapped children are
+        # on `done`.  A slashed node's children are the non-spine children of
+        # every node along its spine.  Shared subderivations are mapped once;
+        # `memo` is keyed by `id`, which is stable since `d` holds every node.
+        # `rules` shares equal weightless rules among the new nodes.
+        memo = {}
+        rules = {}
+        done = []
+        stack = [(d, None)]
+        while stack:
+            d, spine = stack.pop()
+            if type(d) is not Derivation:
+                done.append(d)
+            elif spine is None:
+                r = memo.get(id(d))
+                if r is not None:
+                    done.append(r)
+                    continue
+                if type(d.x) is Slash:
+                    spine = []
+                    curr = d
+                    while len(curr.ys) != 0:
+                        assert type(curr.x) is Slash
+                        spine.append(curr.ys)
+                        curr = curr.ys[0]
+                    stack.append((d, spine))
+                    for ys in reversed(spine):
+                        stack.extend((y, None) for y in reversed(ys[1:]))
+                else:
+                    stack.append((d, ()))
+                    stack.extend((y, None) for y in reversed(d.ys))
+            elif type(d.x) is Slash:
+                n = sum(len(ys) - 1 for ys in spine)
+                rests = done[len(done)-n:]
+                del done[len(done)-n:]
+                num = d.x.Y
+                new = _tree(slash(num, num), (), rules)
+                i = 0
+                for ys in spine:
+                    j = i + len(ys) - 1
+                    new = _tree(slash(num, ys[0].x.Y), (*rests[i:j], new), rules)
+                    i = j
+                done.append(new)
+                memo[id(d)] = new
+            else:
+                n = len(d.ys)
+                children = tuple(done[len(done)-n:])
+                del done[len(done)-n:]
+                done.append(_tree(d.x, children, rules))
+                memo[id(d)] = done[-1]
+        [d] = done
+        return d
 
     def elim_nullary_slash(self, binarize=True):
         """
         Optimized method for eliminating nullary rules created by the
         left-corner and speculation transformations; should match `nullaryremove`.
         """
-        if binarize: self = self.binarize()
+        if binarize: self = self._binarized
 
-        W = self.R.chart()
-        v = self.R.chart()
+        null_weight = None
+        if self.R is Real:
+            null_weight = self._slash_null_weight_dense()
 
-        for p in self:
-            head, body = p
+        if null_weight is None:
+            W = self.R.chart()
+            v = self.R.chart()
 
-            # unary slash
-            if len(body) == 1 and isinstance(head, Slash):
-                assert isinstance(body[0], Slash)
-                W[head, body[0]] += p.w
+            for p in self:
+                head, body = p
+                if type(head) is Slash:
 
-            # nullary slash
-            if len(body) == 0 and isinstance(head, Slash):
-                v[head] += p.w
+                    # unary slash
+                    if len(body) == 1:
+                        assert isinstance(body[0], Slash)
+                        W[head, body[0]] += p.w
 
-            # This optimized method assumes that the grammar prior to
-            # transformation is nullary free.  If the assertion below fails,
-            # then so does that assumption.
-            assert not len(body) == 0 or isinstance(head, Slash), p
+                    # nullary slash
+                    elif len(body) == 0:
+                        v[head] += p.w
 
-        K = self._lehmann(self.N, W)
+                else:
+                    # This optimized method assumes that the grammar prior to
+                    # transformation is nullary free.  If the assertion below
+                    # fails, then so does that assumption.
+                    assert len(body) != 0, p
 
-        null_weight = self.R.chart()
-        for X in self.N:
-            for Y in self.N:
-                null_weight[X] += K[X,Y] * v[Y]
+            K = self._lehmann(self.N, W)
+            null_weight = self.R.chart()
+            for X in self.N:
+                for Y in self.N:
+                    null_weight[X] += K[X,Y] * v[Y]
 
         return self._push_null_weights(null_weight)
 
 
 def tree(x, *ys):
-    r = Rule(None, x, tuple(label(y) for y in ys))
+    r = Rule(None, x, tuple([y.x if type(y) is Derivation else y for y in ys]))
     return Derivation(r, x, *ys)
 
 
-def label(d):
-    return d.x if isinstance(d, Derivation) else d
+def _tree(x, ys, rules):
+    """
+    `tree` with the children already in a tuple; equal weightless rules are
+    shared through the dict `rules`.
+    """
+    body = tuple([y.x if type(y) is Derivation else y for y in ys])
+    r = rules.get((x, body))
+    if r is None:
+        r = rules[x, body] = Rule(None, x, body)
+    return Derivation(r, x, *ys)
@@ -4,12 +4,25 @@ from collections import defaultdict
 
 class Semiring:
 
+    # NumPy dtype used to store values in an `ArrayChart`; `object` stores the
+    # semiring values themselves, numeric dtypes store their `score`.
+    dtype = object
+
     def __init__(self, score):
         self.score = score
 
     @classmethod
-    def chart(cls):
-        return defaultdict(lambda: cls.zero)
+    def chart(cls, shape=None, index=None):
+        """
+        Create a chart that maps items to values, where missing items have value
+        `zero`.  By default, the chart is a dictionary.  Callers that know the
+        `shape` of the item space get a dense `ArrayChart` instead (see its
+        docstring for `index`).
+        """
+        if shape is None:
+            return defaultdict(lambda: cls.zero)
+        fill = cls.zero if cls.dtype is object else cls.zero.score
+        return ArrayChart(cls, np.full(shape, fill, dtype=cls.dtype), index)
 
 #    @classmethod
 #    def zeros(cls, *shape):
@@ -49,6 +62,81 @@ class Semiring:
         return self != other
 
 
+class ArrayChart:
+    """
+    Chart backed by a dense array `a`.  Item `(x1, ..., xn)` is stored at
+    `a[i1, ..., in]` where `ik = index[k][xk]`, or `ik = xk` if `index[k]` is
+    None (i.e., integer positions).  Reading an item that is not in the index
+    gives `R.zero`, as in the dictionary charts.
+    """
+
+    __slots__ = ('R', 'a', 'index')
+
+    def __init__(self, R, a, index=None):
+        self.R = R
+        self.a = a
+        self.index = (None,) * a.ndim if index is None else tuple(index)
+
+    def _key(self, item):
+        "Array index of `item`; raises `KeyError` if it is not in the chart's domain."
+        if not isinstance(item, tuple): item = (item,)
+        k = []
+        for x, m, n in zip(item, self.index, self.a.shape):
+            if m is not None:
+                k.append(m[x])
+            elif 0 <= x < n:   # not numpy's wraparound for negative positions
+                k.append(x)
+            else:
+                raise KeyError(item)
+        return tuple(k)
+
+    def _box(self, v):
+        return v if self.R.dtype is object else self.R(v.item())
+
+    def __getitem__(self, item):
+        try:
+            k = self._key(item)
+        except KeyError:
+            return self.R.zero
+        return self._box(self.a[k])
+
+    def __setitem__(self, item, value):
+        self.a[self._key(item)] = value if self.R.dtype is object else value.score
+
+    def items(self):
+        "Iterate over the items with nonzero value."
+        zero = self._zero()
+        keys = [None if m is None else list(m) for m in self.index]
+        for k in np.argwhere(self.a != zero):
+            item = tuple(int(i) if m is None else m[i] for i, m in zip(k, keys))
+            yield (item if len(item) > 1 else item[0]), self._box(self.a[tuple(k)])
+
+    def keys(self):
+        return {k for k, _ in self.items()}
+
+    def values(self):
+        return [v for _, v in self.items()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def _zero(self):
+        return self.R.zero if self.R.dtype is object else self.R.zero.score
+
+    def __len__(self):
+        return int(np.count_nonzero(self.a != self._zero()))
+
+    def __contains__(self, item):
+        try:
+            k = self._key(item)
+        except KeyError:
+            return False
+        return bool(self.a[k] != self._zero())
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}({dict(self.items())})'
+
+
 class Entropy(Semiring):
 
     def __init__(self, p, r):
@@ -102,6 +190,8 @@ Entropy.one = Entropy(1.0, 0.0)
 
 class Boolean(Semiring):
 
+    dtype = np.bool_
+
     def star(self):
         return Boolean.one
 
@@ -129,6 +219,8 @@ Boolean.one = Boolean(True)
 
 class MaxPlus(Semiring):
 
+    dtype = np.float64
+
     def star(self):
         return self.one
 
@@ -144,6 +236,8 @@ MaxPlus.one = MaxPlus(0.0)
 
 class MaxTimes(Semiring):
 
+    dtype = np.float64
+
     def star(self):
         return self.one
 
@@ -159,6 +253,8 @@ MaxTimes.one = MaxTimes(1)
 
 class Real(Semiring):
 
+    dtype = np.float64
+
     def star(self):
         return Real(1 / (1 - self.score))
 
@@ -180,6 +276,8 @@ Real.one = Real(1)
 
 class Log(Semiring):
 
+    dtype = np.float64
+
     def metric(self, other):
         return abs(self.score - other.score)
 
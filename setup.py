@@ -21,6 +21,9 @@ setup(
         'graphviz',   # for notebook visualization of left-recursion graph
         'path'
     ],
+    extras_require = {
+        'jit': ['numba'],   # compiled CKY and agenda kernels
+    },
     authors = [
         'Andreas Opedal',
         'Eleftheria Tsipidi'